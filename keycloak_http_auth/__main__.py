@@ -1,8 +1,10 @@
 import asyncio
+import gc
 import logging
 
 from rest_tools.utils import from_environment
 
+from .monitor import LoopMonitor
 from .server import create_server
 
 # handle logging
@@ -18,6 +20,11 @@ setlevel = {
 
 default_config = {
     'LOG_LEVEL': 'INFO',
+    'LOOP_MONITOR': False,
+    'LOOP_MONITOR_INTERVAL': .1,
+    'SLOW_CALLBACK_THRESHOLD': .5,
+    'GC_FREEZE': False,
+    'PROMETHEUS_PORT': 0,
 }
 config = from_environment(default_config)
 if config['LOG_LEVEL'].upper() not in setlevel:
@@ -28,4 +35,19 @@ logging.basicConfig(format=logformat, level=setlevel[config['LOG_LEVEL'].upper()
 
 # start server
 create_server()
+
+if config['LOOP_MONITOR']:
+    if not config['PROMETHEUS_PORT']:
+        logging.warning('LOOP_MONITOR is set without PROMETHEUS_PORT, so only slow callbacks are reported')
+    LoopMonitor(
+        interval=config['LOOP_MONITOR_INTERVAL'],
+        threshold=config['SLOW_CALLBACK_THRESHOLD'],
+    ).start()
+
+if config['GC_FREEZE']:
+    # move the long-lived startup objects out of future collections
+    gc.collect()
+    gc.freeze()
+    logging.info(f'froze {gc.get_freeze_count()} objects after startup')
+
 asyncio.get_event_loop().run_forever()
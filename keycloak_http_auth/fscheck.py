@@ -0,0 +1,360 @@
+"""
+Filesystem permission pre-check for auth requests
+"""
+
+import asyncio
+from collections import OrderedDict
+import ctypes
+import ctypes.util
+import logging
+import os
+import posixpath
+import re
+import stat
+import struct
+from urllib.parse import unquote
+
+
+# inotify event masks, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+READ_METHODS = {'GET', 'HEAD', 'COPY'}
+# these only need search permission on the directories along the way
+SEARCH_METHODS = {'OPTIONS', 'PROPFIND'}
+WRITE_METHODS = {'PUT', 'DELETE', 'MKCOL', 'MOVE'}
+
+R_OK, W_OK, X_OK = 4, 2, 1
+
+
+class Inotify:
+    """Minimal ctypes wrapper around the Linux inotify API."""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """Yield (wd, mask, name) for all pending events."""
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset+length].rstrip(b'\0')
+                offset += length
+                yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class StatCache:
+    """
+    A bounded cache of (mode, uid, gid) for paths, invalidated by inotify.
+
+    Each cached path is tied to a watch on its parent directory, or on
+    itself for the top-level directory.  A watch is released once no
+    cached paths are tied to it.  A path is only cached if its parent
+    directory is, so invalidating a directory only has to walk the
+    cached paths below it.  When inotify is unavailable, paths are
+    stat-ed directly without caching.
+
+    Symlinks are not followed, since changes to their targets are not
+    seen by the watches here.  Files with more than one hard link are
+    not cached, since they can be changed through other paths.
+
+    Args:
+        max_entries (int): maximum number of cached paths
+        max_watches (int): maximum number of inotify watches
+    """
+    def __init__(self, max_entries=100000, max_watches=8192):
+        self.max_entries = max_entries
+        self.max_watches = max_watches
+        # path -> ((mode, uid, gid) or None if missing, watched directory)
+        self._entries = OrderedDict()
+        # watched directory -> set of cached paths tied to it
+        self._children = {}
+        self._watches = {}  # wd -> directory
+        self._watched = {}  # directory -> wd
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError):
+            logging.warning('inotify unavailable, stat cache disabled', exc_info=True)
+            self._inotify = None
+        else:
+            asyncio.get_event_loop().add_reader(self._inotify.fd, self.process_events)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        if self._inotify is not None:
+            asyncio.get_event_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+        self._entries.clear()
+        self._children.clear()
+        self._watches.clear()
+        self._watched.clear()
+
+    def _watch(self, directory):
+        if directory in self._watched:
+            return True
+        # make room by evicting the least recently used paths
+        while len(self._watched) >= self.max_watches and self._entries:
+            self._invalidate_tree(next(iter(self._entries)))
+        if len(self._watched) >= self.max_watches:
+            return False
+        try:
+            wd = self._inotify.add_watch(directory, WATCH_MASK)
+        except OSError:
+            return False
+        self._watches[wd] = directory
+        self._watched[directory] = wd
+        return True
+
+    def _release(self, directory):
+        wd = self._watched.pop(directory, None)
+        if wd is not None:
+            del self._watches[wd]
+            self._inotify.rm_watch(wd)
+
+    def _drop(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        directory = entry[1]
+        children = self._children[directory]
+        children.discard(path)
+        if not children:
+            del self._children[directory]
+            self._release(directory)
+
+    def _invalidate_tree(self, path):
+        stack = [path]
+        while stack:
+            p = stack.pop()
+            stack.extend(c for c in self._children.get(p, ()) if c != p)
+            self._drop(p)
+
+    def _clear(self):
+        for wd in self._watches:
+            self._inotify.rm_watch(wd)
+        self._entries.clear()
+        self._children.clear()
+        self._watches.clear()
+        self._watched.clear()
+
+    def stat(self, path, top=False):
+        """
+        Get (mode, uid, gid) for a path, without following a final symlink.
+
+        Args:
+            path (str): absolute, normalized path
+            top (bool): path is the top-level directory, so watch it directly
+
+        Returns:
+            tuple: (mode, uid, gid), or None if the path does not exist
+
+        Raises:
+            OSError: for errors other than a missing path
+        """
+        entry = self._entries.get(path)
+        if entry is not None:
+            self._entries.move_to_end(path)
+            return entry[0]
+
+        directory = path if top else posixpath.dirname(path)
+        # watch before the stat, so no change in between is missed
+        watched = (
+            self._inotify is not None and self.max_entries > 0
+            and (top or directory in self._entries)
+            and self._watch(directory)
+        )
+
+        try:
+            st = os.lstat(path)
+            ret = (st.st_mode, st.st_uid, st.st_gid)
+            # other links to the file are outside of the watches
+            cacheable = st.st_nlink == 1 or stat.S_ISDIR(st.st_mode)
+        except (FileNotFoundError, NotADirectoryError):
+            ret = None
+            cacheable = True
+
+        # the parent may have been evicted to make room for the watch
+        if watched and cacheable and (top or directory in self._entries):
+            self._entries[path] = (ret, directory)
+            self._children.setdefault(directory, set()).add(path)
+            while len(self._entries) > self.max_entries:
+                self._invalidate_tree(next(iter(self._entries)))
+        elif watched and directory not in self._children:
+            self._release(directory)
+        return ret
+
+    def process_events(self):
+        """Invalidate cache entries for all pending inotify events."""
+        if self._inotify is None:
+            return
+        for wd, mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                logging.info('inotify queue overflow, clearing stat cache')
+                self._clear()
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                # a watch that was already released
+                continue
+            if name:
+                self._invalidate_tree(posixpath.join(directory, name))
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # the watch is gone, or now points at the wrong path
+                self._invalidate_tree(directory)
+                self._release(directory)
+            else:
+                self._invalidate_tree(directory)
+
+
+def has_access(st, bits, uid, groups):
+    """Check POSIX mode bits for a (mode, uid, gid) tuple."""
+    mode, f_uid, f_gid = st
+    if f_uid == uid:
+        perm = mode >> 6
+    elif f_gid in groups:
+        perm = mode >> 3
+    else:
+        perm = mode
+    return perm & bits == bits
+
+
+class FilesystemChecker:
+    """
+    Check whether a user can obviously not access a request path.
+
+    Mirrors the nginx `alias` of `/` to `base_path`.  Anything that
+    cannot be decided here (missing paths, symlinks, stat errors) is
+    allowed through to nginx.  Only POSIX mode bits are considered, so this
+    should not be used on filesystems that rely on ACLs.
+
+    Args:
+        base_path (str): the filesystem path served at `/`
+        stat_cache (StatCache): the stat cache to use
+        index_files (tuple): the nginx `index` files for directories
+    """
+    def __init__(self, base_path, stat_cache, index_files=('index.html',)):
+        self.base_path = os.path.realpath(base_path)
+        self.stat_cache = stat_cache
+        self.index_files = index_files
+
+    def resolve(self, uri):
+        """Get the path components of a request uri, as nginx would."""
+        # not urlsplit, which would take a leading "//" as a netloc
+        path = re.sub('/+', '/', uri.split('?', 1)[0])
+        path = posixpath.normpath('/' + unquote(path))
+        return [p for p in path.split('/') if p]
+
+    def allowed(self, method, uri, uid, groups):
+        """
+        Check if a request could be allowed by the filesystem.
+
+        Args:
+            method (str): the original request method
+            uri (str): the original request uri
+            uid (int): the user's uid
+            groups (set): all of the user's gids
+
+        Returns:
+            bool: False if the request is certain to be denied
+        """
+        if uid == 0 or not (method in READ_METHODS or method in SEARCH_METHODS or method in WRITE_METHODS):
+            return True
+        parts = self.resolve(uri)
+
+        try:
+            path = self.base_path
+            st = self.stat_cache.stat(path, top=True)
+            if st is None:
+                return True
+            # search permission on each directory along the way
+            for i, name in enumerate(parts):
+                # also stops at symlinks, which are not followed
+                if not stat.S_ISDIR(st[0]):
+                    return True
+                if not has_access(st, X_OK, uid, groups):
+                    return False
+                parent_st = st
+                path = posixpath.join(path, name)
+                st = self.stat_cache.stat(path)
+                if st is None:
+                    # PUT creates missing directories, MKCOL only the last one
+                    if method == 'PUT' or (method == 'MKCOL' and i == len(parts) - 1):
+                        return has_access(parent_st, W_OK | X_OK, uid, groups)
+                    return True
+
+            if method in SEARCH_METHODS:
+                return True
+            elif method in READ_METHODS:
+                if stat.S_ISLNK(st[0]):
+                    return True
+                elif not stat.S_ISDIR(st[0]):
+                    return has_access(st, R_OK, uid, groups)
+                if method == 'COPY' or not uri.split('?', 1)[0].endswith('/'):
+                    # a recursive copy or a redirect, so nothing certain
+                    return True
+                return self._index_allowed(path, st, uid, groups)
+            elif not parts:
+                # cannot modify the base path itself
+                return True
+            else:
+                return has_access(parent_st, W_OK | X_OK, uid, groups)
+        except OSError:
+            logging.debug('stat error in filesystem check', exc_info=True)
+            return True
+
+    def _index_allowed(self, path, st, uid, groups):
+        """Check a directory GET, which serves an index file or a listing."""
+        # the index module needs search permission to look for index files
+        if not has_access(st, X_OK, uid, groups):
+            return False
+        for name in self.index_files:
+            index_st = self.stat_cache.stat(posixpath.join(path, name))
+            if index_st is not None:
+                if stat.S_ISREG(index_st[0]):
+                    return has_access(index_st, R_OK, uid, groups)
+                return True
+        # otherwise fancyindex lists the directory
+        return has_access(st, R_OK, uid, groups)
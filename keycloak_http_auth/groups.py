@@ -0,0 +1,117 @@
+"""
+Supplementary group lookup from a group file
+"""
+
+import logging
+import os
+import time
+
+
+def parse_group_file(path):
+    """
+    Parse a file in `/etc/group` format.
+
+    Args:
+        path (str): path to the group file
+
+    Returns:
+        dict: group name -> (gid, frozenset of member usernames)
+    """
+    groups = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in '#+-':
+                continue
+            parts = line.split(':')
+            if len(parts) != 4:
+                continue
+            try:
+                gid = int(parts[2])
+            except ValueError:
+                continue
+            members = frozenset(m.strip() for m in parts[3].split(',') if m.strip())
+            groups[parts[0]] = (gid, members)
+    return groups
+
+
+class GroupIndex:
+    """
+    An index of username -> supplementary gids, from a group file.
+
+    The file is checked for changes at most every `check_interval`
+    seconds.  When it changes, only the groups that were added, removed,
+    or modified are applied to the index.
+
+    Args:
+        path (str): path to the group file
+        check_interval (float): seconds between checks for file changes
+    """
+    def __init__(self, path='/etc/group', check_interval=10.):
+        self.path = path
+        self.check_interval = check_interval
+        self._file_id = None
+        self._next_check = 0.
+        self._groups = {}
+        # username -> {gid: number of groups with that gid}
+        self._index = {}
+        self.refresh()
+
+    def _add(self, gid, members):
+        for user in members:
+            gids = self._index.setdefault(user, {})
+            gids[gid] = gids.get(gid, 0) + 1
+
+    def _remove(self, gid, members):
+        for user in members:
+            gids = self._index[user]
+            gids[gid] -= 1
+            if not gids[gid]:
+                del gids[gid]
+                if not gids:
+                    del self._index[user]
+
+    def refresh(self):
+        """
+        Update the index if the group file changed.
+
+        Returns:
+            bool: True if the index was updated
+        """
+        self._next_check = time.monotonic() + self.check_interval
+        try:
+            st = os.stat(self.path)
+            file_id = (st.st_ino, st.st_size, st.st_mtime_ns)
+            if file_id == self._file_id:
+                return False
+            groups = parse_group_file(self.path)
+        except (OSError, ValueError):
+            # keep the old index, and retry on the next check
+            logging.warning(f'cannot read group file {self.path}', exc_info=True)
+            return False
+
+        old_groups = self._groups
+        for name, entry in old_groups.items():
+            if groups.get(name) != entry:
+                self._remove(*entry)
+        for name, entry in groups.items():
+            if old_groups.get(name) != entry:
+                self._add(*entry)
+        self._groups = groups
+        self._file_id = file_id
+        logging.info(f'loaded {len(groups)} groups from {self.path}')
+        return True
+
+    def lookup(self, username):
+        """
+        Get the supplementary gids for a user.
+
+        Args:
+            username (str): the username
+
+        Returns:
+            set: gids
+        """
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        return set(self._index.get(username, ()))
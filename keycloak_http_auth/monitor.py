@@ -0,0 +1,92 @@
+"""
+Event loop lag and garbage collection monitoring
+"""
+
+import asyncio
+import gc
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from prometheus_client import Counter, Histogram
+
+
+LOOP_LAG = Histogram('keycloak_http_auth_loop_lag_seconds', 'event loop scheduling lag',
+                     buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+SLOW_CALLBACKS = Counter('keycloak_http_auth_slow_callbacks', 'callbacks that blocked the event loop past the threshold')
+GC_PAUSE = Histogram('keycloak_http_auth_gc_pause_seconds', 'garbage collection pause', ['generation'],
+                     buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+
+
+class LoopMonitor:
+    """
+    Measure event loop lag, and report callbacks that block the loop.
+
+    A timer on the loop records how late it runs.  A watchdog thread
+    checks that the timer keeps running, and if the loop is blocked
+    for longer than `threshold` it logs the stack of the loop thread.
+    Garbage collection pauses are recorded per generation.
+
+    Must be started from the thread running the event loop.
+
+    Args:
+        interval (float): seconds between lag measurements
+        threshold (float): seconds the loop can be blocked before logging
+    """
+    def __init__(self, interval=.1, threshold=.5):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop = None
+        self._handle = None
+        self._thread = None
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._last_tick = 0.
+        self._reported_tick = None
+        self._gc_start = None
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        self._thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._tick, self._last_tick + self.interval)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watchdog, name='loop-monitor', daemon=True)
+        self._thread.start()
+        gc.callbacks.append(self._gc_callback)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._handle.cancel()
+        gc.callbacks.remove(self._gc_callback)
+
+    def _tick(self, expected):
+        now = time.monotonic()
+        LOOP_LAG.observe(max(0., now - expected))
+        self._last_tick = now
+        self._handle = self._loop.call_later(self.interval, self._tick, now + self.interval)
+
+    def _watchdog(self):
+        while not self._stop.wait(self.interval):
+            last_tick = self._last_tick
+            blocked = time.monotonic() - last_tick - self.interval
+            if blocked > self.threshold and last_tick != self._reported_tick:
+                # only report each stall once
+                self._reported_tick = last_tick
+                SLOW_CALLBACKS.inc()
+                frame = sys._current_frames().get(self._thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame else ''
+                logging.warning(f'event loop blocked for {blocked:.3f}s:\n{stack}')
+
+    def _gc_callback(self, phase, info):
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            GC_PAUSE.labels(generation=info['generation']).observe(time.perf_counter() - self._gc_start)
+            self._gc_start = None
@@ -0,0 +1,109 @@
+"""
+Token-bucket rate limiting for auth requests
+"""
+
+from collections import OrderedDict
+import time
+
+
+class TokenBucketLimiter:
+    """
+    A table of token buckets, one per key.
+
+    Each bucket holds up to `burst` tokens and refills at `rate` tokens
+    per second.  The table is kept in least-recently-used order and is
+    bounded by `max_entries`.  A bucket that has been idle long enough
+    to refill completely is indistinguishable from a new one, so it is
+    dropped as soon as it reaches the front of the table.
+
+    Args:
+        rate (float): tokens added per second
+        burst (int): bucket capacity
+        max_entries (int): maximum number of buckets to track
+        on_evict (callable): called with the key of each evicted bucket (optional)
+    """
+    def __init__(self, rate, burst, max_entries=10000, on_evict=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        if burst < 1:
+            raise ValueError('burst must be at least 1')
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_entries = max_entries
+        self.idle_timeout = self.burst / self.rate
+        self.on_evict = on_evict
+        # key -> [tokens, last update time]
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _refill(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[key] = bucket
+        else:
+            tokens = bucket[0] + (now - bucket[1]) * self.rate
+            bucket[0] = tokens if tokens < self.burst else self.burst
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self, now):
+        buckets = self._buckets
+        cutoff = now - self.idle_timeout
+        while buckets:
+            bucket = next(iter(buckets.values()))
+            if len(buckets) <= self.max_entries and bucket[1] > cutoff:
+                break
+            key, _ = buckets.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(key)
+
+    def acquire(self, key, now=None):
+        """
+        Take a token from the bucket for `key`.
+
+        Args:
+            key (str): the bucket key
+            now (float): current monotonic time (optional)
+
+        Returns:
+            float: 0 if a token was taken, else the seconds until one is available
+        """
+        if now is None:
+            now = time.monotonic()
+        bucket = self._refill(key, now)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            wait = 0.
+        else:
+            wait = (1 - bucket[0]) / self.rate
+        self._evict(now)
+        return wait
+
+    def peek(self, key, now=None):
+        """
+        Check the bucket for `key` without taking a token.
+
+        Keys that are not tracked are never limited, and are not added.
+
+        Args:
+            key (str): the bucket key
+            now (float): current monotonic time (optional)
+
+        Returns:
+            float: 0 if a token is available, else the seconds until one is
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0.
+        if now is None:
+            now = time.monotonic()
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens >= 1:
+            return 0.
+        return (1 - tokens) / self.rate
@@ -3,13 +3,96 @@ Server for keycloak token http auth
 """
 
 import logging
+import math
 
+from prometheus_client import Counter, start_http_server
 from tornado.web import HTTPError
 from rest_tools.server import RestServer, RestHandler, RestHandlerSetup, authenticated, catch_error
 from rest_tools.utils import from_environment
 
+from .fscheck import FilesystemChecker, StatCache
+from .groups import GroupIndex
+from .ratelimit import TokenBucketLimiter
+
+
+THROTTLED_USERS = Counter('keycloak_http_auth_throttled_users', 'authenticated requests rejected by the rate limiter', ['user'])
+THROTTLED_CLIENTS = Counter('keycloak_http_auth_throttled_clients', 'unauthenticated requests rejected by the rate limiter')
+
+
+class ThrottledUsers:
+    """
+    Per-user throttle counters, bounded by the rate limiter's table.
+
+    Several limiter keys can share a username, so a user's series is
+    only removed once the buckets for all of their keys are evicted.
+    Pass this as the limiter's `on_evict` callback.
+    """
+    def __init__(self):
+        self._labels = {}  # limiter key -> username
+        self._refs = {}  # username -> number of limiter keys
+
+    def inc(self, key, username):
+        if self._labels.get(key) != username:
+            self(key)
+            self._labels[key] = username
+            self._refs[username] = self._refs.get(username, 0) + 1
+        THROTTLED_USERS.labels(user=username).inc()
+
+    def __call__(self, key):
+        username = self._labels.pop(key, None)
+        if username is None:
+            return
+        self._refs[username] -= 1
+        if not self._refs[username]:
+            del self._refs[username]
+            try:
+                THROTTLED_USERS.remove(username)
+            except KeyError:
+                pass
+
 
 class Main(RestHandler):
+    def initialize(self, rate_limiter=None, throttled_users=None, fs_checker=None, group_index=None, **kwargs):
+        super().initialize(**kwargs)
+        self.rate_limiter = rate_limiter
+        self.throttled_users = throttled_users
+        self.fs_checker = fs_checker
+        self.group_index = group_index
+        self.retry_after = None
+
+    def get_client_ip(self):
+        return self.request.headers.get('X-Real-IP', self.request.remote_ip)
+
+    def throttle(self, wait):
+        self.retry_after = max(1, math.ceil(wait))
+        raise HTTPError(429, reason='rate limit exceeded')
+
+    def prepare(self):
+        super().prepare()
+        if self.rate_limiter is not None:
+            # limit by client ip before any token verification
+            key = f'ip:{self.get_client_ip()}'
+            if 'Authorization' in self.request.headers:
+                # only clients that have already failed auth are tracked
+                wait = self.rate_limiter.peek(key)
+            else:
+                wait = self.rate_limiter.acquire(key)
+            if wait:
+                THROTTLED_CLIENTS.inc()
+                self.throttle(wait)
+
+    def get_current_user(self):
+        user = super().get_current_user()
+        if user is None and self.rate_limiter is not None and 'Authorization' in self.request.headers:
+            # charge failed verifications to the client ip
+            self.rate_limiter.acquire(f'ip:{self.get_client_ip()}')
+        return user
+
+    def write_error(self, status_code=500, **kwargs):
+        if self.retry_after is not None:
+            self.set_header('Retry-After', self.retry_after)
+        super().write_error(status_code, **kwargs)
+
     @authenticated
     @catch_error
     async def get(self, *args):
@@ -29,6 +112,14 @@ class Main(RestHandler):
         if not username:
             raise HTTPError(400, 'username missing from token')
 
+        if self.rate_limiter is not None:
+            key = f'sub:{token["sub"]}'
+            wait = self.rate_limiter.acquire(key)
+            if wait:
+                logging.info(f'rate limit exceeded for user {username}')
+                self.throttled_users.inc(key, username)
+                self.throttle(wait)
+
         logging.info(f'request for user {username}: {method}:{path}')
 
         # check for posix info
@@ -41,8 +132,20 @@ class Main(RestHandler):
         gids = set(token.get('posix', {}).get('group_gids', []))
         if gid:
             gids.add(gid)
+        if self.group_index is not None:
+            gids.update(self.group_index.lookup(username))
 
         # if you want to do other checks, add them here
+        if self.fs_checker is not None:
+            try:
+                # token values may be strings, while st_uid/st_gid are ints
+                fs_uid = int(uid)
+                fs_gids = {int(g) for g in gids}
+            except (TypeError, ValueError):
+                logging.info(f'non-numeric uid or gids for user {username}, skipping filesystem check')
+            else:
+                if not self.fs_checker.allowed(method, path, fs_uid, fs_gids):
+                    raise HTTPError(403, reason='filesystem permission denied')
 
         # set nginx uid and gid
         self.set_header('REMOTE_USER', username)
@@ -66,6 +169,16 @@ def create_server():
         'AUDIENCE': None,
         'KEYCLOAK_URL': None,
         'KEYCLOAK_REALM': 'IceCube',
+        'RATE_LIMIT': 0.,
+        'RATE_LIMIT_BURST': 10,
+        'RATE_LIMIT_MAX_ENTRIES': 10000,
+        'PROMETHEUS_PORT': 0,
+        'BASE_PATH': '/mnt',
+        'FS_PRECHECK': False,
+        'FS_STAT_CACHE_SIZE': 100000,
+        'FS_MAX_WATCHES': 8192,
+        'GROUP_FILE': '',
+        'GROUP_FILE_CHECK_INTERVAL': 10.,
     }
     config = from_environment(default_config)
 
@@ -79,9 +192,35 @@ def create_server():
     }
     kwargs = RestHandlerSetup(rest_config)
 
+    main_kwargs = kwargs.copy()
+    if config['RATE_LIMIT'] > 0:
+        main_kwargs['throttled_users'] = ThrottledUsers()
+        main_kwargs['rate_limiter'] = TokenBucketLimiter(
+            rate=config['RATE_LIMIT'],
+            burst=config['RATE_LIMIT_BURST'],
+            max_entries=config['RATE_LIMIT_MAX_ENTRIES'],
+            on_evict=main_kwargs['throttled_users'],
+        )
+
+    if config['FS_PRECHECK']:
+        stat_cache = StatCache(
+            max_entries=config['FS_STAT_CACHE_SIZE'],
+            max_watches=config['FS_MAX_WATCHES'],
+        )
+        main_kwargs['fs_checker'] = FilesystemChecker(config['BASE_PATH'], stat_cache)
+
+    if config['GROUP_FILE']:
+        main_kwargs['group_index'] = GroupIndex(
+            config['GROUP_FILE'],
+            check_interval=config['GROUP_FILE_CHECK_INTERVAL'],
+        )
+
+    if config['PROMETHEUS_PORT']:
+        start_http_server(config['PROMETHEUS_PORT'])
+
     server = RestServer(debug=config['DEBUG'])
     server.add_route('/healthz', Health, kwargs)
-    server.add_route(r'/(.*)', Main, kwargs)
+    server.add_route(r'/(.*)', Main, main_kwargs)
 
     server.startup(address=config['HOST'], port=config['PORT'])
 
@@ -0,0 +1,232 @@
+import asyncio
+import os
+
+import pytest
+import pytest_asyncio
+
+from keycloak_http_auth.fscheck import FilesystemChecker, StatCache, has_access
+
+# a user that neither owns the test files nor is in their group
+UID = os.getuid() + 1000
+GROUPS = {os.getgid() + 1000}
+
+
+@pytest_asyncio.fixture
+async def checker(tmp_path):
+    base_path = tmp_path / 'base'
+    base_path.mkdir()
+    cache = StatCache()
+    try:
+        yield FilesystemChecker(str(base_path), cache), base_path
+    finally:
+        cache.close()
+
+def test_has_access():
+    st = (0o640, 1000, 1001)
+    assert has_access(st, 4, 1000, set())
+    assert has_access(st, 2, 1000, set())
+    assert has_access(st, 4, 2000, {1001})
+    assert not has_access(st, 2, 2000, {1001})
+    assert not has_access(st, 4, 2000, {2000})
+    # owner bits win over group bits
+    assert not has_access((0o070, 1000, 1001), 4, 1000, {1001})
+
+def test_resolve():
+    fs = FilesystemChecker('/', None)
+    assert fs.resolve('/') == []
+    assert fs.resolve('/foo/bar?baz=1') == ['foo', 'bar']
+    assert fs.resolve('/foo%20bar//baz/') == ['foo bar', 'baz']
+    assert fs.resolve('/../foo/../../bar') == ['bar']
+    assert fs.resolve('//data/secret/file') == ['data', 'secret', 'file']
+    assert fs.resolve('//data//file?a=//b') == ['data', 'file']
+
+@pytest.mark.asyncio
+async def test_read(checker):
+    fs, base_path = checker
+    d = base_path / 'dir'
+    d.mkdir()
+    (d / 'file').write_text('foo')
+    (d / 'file').chmod(0o600)
+    assert fs.allowed('GET', '/dir/', UID, GROUPS)
+    assert not fs.allowed('GET', '/dir/file', UID, GROUPS)
+    assert fs.allowed('GET', '/dir/missing', UID, GROUPS)
+
+    (d / 'file').chmod(0o640)
+    await asyncio.sleep(.01)
+    assert fs.allowed('GET', '/dir/file', UID, {os.getgid()})
+
+    d.chmod(0o700)
+    await asyncio.sleep(.01)
+    assert not fs.allowed('GET', '/dir/file', UID, GROUPS)
+    assert fs.allowed('GET', '/dir/file', 0, {0})
+
+@pytest.mark.asyncio
+async def test_write(checker):
+    fs, base_path = checker
+    d = base_path / 'dir'
+    d.mkdir()
+    d.chmod(0o755)
+    assert fs.allowed('GET', '/dir/file', UID, GROUPS)
+    assert not fs.allowed('PUT', '/dir/file', UID, GROUPS)
+    assert not fs.allowed('PUT', '/dir/sub/file', UID, GROUPS)
+    assert not fs.allowed('MKCOL', '/dir/sub', UID, GROUPS)
+    # missing intermediate directories are a conflict, not a denial
+    assert fs.allowed('MKCOL', '/dir/sub/sub2', UID, GROUPS)
+    assert fs.allowed('DELETE', '/dir/missing', UID, GROUPS)
+
+    d.chmod(0o777)
+    await asyncio.sleep(.01)
+    assert fs.allowed('PUT', '/dir/file', UID, GROUPS)
+    assert fs.allowed('PUT', '/dir/sub/file', UID, GROUPS)
+
+@pytest.mark.asyncio
+async def test_invalidate_tree(checker):
+    fs, base_path = checker
+    d = base_path / 'dir'
+    (d / 'sub').mkdir(parents=True)
+    (d / 'sub' / 'file').write_text('foo')
+    (d / 'sub' / 'file').chmod(0o600)
+    assert not fs.allowed('GET', '/dir/sub/file', UID, GROUPS)
+    assert len(fs.stat_cache) == 4
+
+    d.rename(base_path / 'dir2')
+    await asyncio.sleep(.01)
+    assert fs.allowed('GET', '/dir/sub/file', UID, GROUPS)
+    assert not fs.allowed('GET', '/dir2/sub/file', UID, GROUPS)
+
+@pytest.mark.asyncio
+async def test_stat_cache_bounded(tmp_path):
+    cache = StatCache(max_entries=4, max_watches=2)
+    try:
+        for name in ('a', 'b', 'c'):
+            (tmp_path / name).mkdir()
+            # each lookup walks down from the top, like FilesystemChecker
+            cache.stat(str(tmp_path), top=True)
+            cache.stat(str(tmp_path / name))
+            cache.stat(str(tmp_path / name / 'file'))
+            assert len(cache._watched) <= 2
+            assert len(cache) <= 4
+        # the most recent path is still cached, after evicting older ones
+        assert str(tmp_path / 'c' / 'file') in cache._entries
+        assert str(tmp_path / 'a' / 'file') not in cache._entries
+    finally:
+        cache.close()
+
+@pytest.mark.asyncio
+async def test_stat_cache_releases_watches(tmp_path):
+    cache = StatCache()
+    try:
+        (tmp_path / 'a').mkdir()
+        (tmp_path / 'a' / 'file').write_text('foo')
+        cache.stat(str(tmp_path), top=True)
+        cache.stat(str(tmp_path / 'a'))
+        cache.stat(str(tmp_path / 'a' / 'file'))
+        assert set(cache._watched) == {str(tmp_path), str(tmp_path / 'a')}
+
+        (tmp_path / 'a' / 'file').chmod(0o600)
+        await asyncio.sleep(.01)
+        assert len(cache) == 2
+        assert set(cache._watched) == {str(tmp_path)}
+        assert cache.stat(str(tmp_path / 'a' / 'file'))[0] & 0o777 == 0o600
+    finally:
+        cache.close()
+
+@pytest.mark.asyncio
+async def test_stat_cache_needs_cached_parent(tmp_path):
+    cache = StatCache()
+    try:
+        (tmp_path / 'a').mkdir()
+        cache.stat(str(tmp_path / 'a'))
+        assert len(cache) == 0
+        assert not cache._watched
+    finally:
+        cache.close()
+
+@pytest.mark.asyncio
+async def test_search_methods(checker):
+    fs, base_path = checker
+    d = base_path / 'dir'
+    d.mkdir()
+    (d / 'file').write_text('foo')
+    (d / 'file').chmod(0o600)
+    assert fs.allowed('PROPFIND', '/dir/file', UID, GROUPS)
+    assert fs.allowed('OPTIONS', '/dir/file', UID, GROUPS)
+
+    d.chmod(0o700)
+    await asyncio.sleep(.01)
+    assert not fs.allowed('PROPFIND', '/dir/file', UID, GROUPS)
+    assert not fs.allowed('OPTIONS', '/dir/file', UID, GROUPS)
+
+@pytest.mark.asyncio
+async def test_directory_index(checker):
+    fs, base_path = checker
+    d = base_path / 'dir'
+    d.mkdir()
+    d.chmod(0o711)
+    # no index file, so nginx lists the directory
+    assert not fs.allowed('GET', '/dir/', UID, GROUPS)
+    # without the trailing slash, nginx redirects
+    assert fs.allowed('GET', '/dir', UID, GROUPS)
+
+    (d / 'index.html').write_text('foo')
+    (d / 'index.html').chmod(0o644)
+    await asyncio.sleep(.01)
+    assert fs.allowed('GET', '/dir/', UID, GROUPS)
+    assert fs.allowed('HEAD', '/dir/?a=b', UID, GROUPS)
+
+    (d / 'index.html').chmod(0o600)
+    await asyncio.sleep(.01)
+    assert not fs.allowed('GET', '/dir/', UID, GROUPS)
+
+    d.chmod(0o744)
+    await asyncio.sleep(.01)
+    assert not fs.allowed('GET', '/dir/', UID, GROUPS)
+
+@pytest.mark.asyncio
+async def test_symlink(checker, tmp_path):
+    fs, base_path = checker
+    d = tmp_path / 'other' / 'd'
+    d.mkdir(parents=True)
+    (d / 'file').write_text('foo')
+    (base_path / 'link').symlink_to(d)
+    (base_path / 'filelink').symlink_to(d / 'file')
+
+    # symlinks are passed through to nginx, whatever their target's mode
+    d.chmod(0o700)
+    (d / 'file').chmod(0o600)
+    assert fs.allowed('GET', '/link/', UID, GROUPS)
+    assert fs.allowed('GET', '/link/file', UID, GROUPS)
+    assert fs.allowed('GET', '/filelink', UID, GROUPS)
+
+    d.chmod(0o755)
+    (d / 'file').chmod(0o644)
+    await asyncio.sleep(.01)
+    assert fs.allowed('GET', '/link/', UID, GROUPS)
+    assert fs.allowed('GET', '/link/file', UID, GROUPS)
+    assert fs.allowed('GET', '/filelink', UID, GROUPS)
+
+@pytest.mark.asyncio
+async def test_symlink_base_path(tmp_path):
+    base_path = tmp_path / 'base'
+    (base_path / 'dir').mkdir(parents=True)
+    (base_path / 'dir').chmod(0o700)
+    (tmp_path / 'link').symlink_to(base_path)
+    cache = StatCache()
+    try:
+        fs = FilesystemChecker(str(tmp_path / 'link'), cache)
+        assert not fs.allowed('GET', '/dir/', UID, GROUPS)
+    finally:
+        cache.close()
+
+@pytest.mark.asyncio
+async def test_hardlink(checker, tmp_path):
+    fs, base_path = checker
+    (base_path / 'file').write_text('foo')
+    (base_path / 'file').chmod(0o600)
+    os.link(base_path / 'file', tmp_path / 'other_link')
+    assert not fs.allowed('GET', '/file', UID, GROUPS)
+    assert str(base_path / 'file') not in fs.stat_cache._entries
+
+    # changed through a path that no watch covers
+    (tmp_path / 'other_link').chmod(0o644)
+    assert fs.allowed('GET', '/file', UID, GROUPS)
@@ -0,0 +1,74 @@
+import os
+
+from keycloak_http_auth.groups import GroupIndex, parse_group_file
+
+
+def test_parse_group_file(tmp_path):
+    p = tmp_path / 'group'
+    p.write_text('''# comment
+root:x:0:
+users:x:100:foo,bar
+
+bad:x:abc:foo
+short:x:101
++nis
+admins:x:200: foo ,
+''')
+    assert parse_group_file(p) == {
+        'root': (0, frozenset()),
+        'users': (100, frozenset({'foo', 'bar'})),
+        'admins': (200, frozenset({'foo'})),
+    }
+
+def test_group_index(tmp_path):
+    p = tmp_path / 'group'
+    p.write_text('users:x:100:foo,bar\nadmins:x:200:foo\n')
+    index = GroupIndex(str(p), check_interval=0)
+    assert index.lookup('foo') == {100, 200}
+    assert index.lookup('bar') == {100}
+    assert index.lookup('baz') == set()
+
+    p.write_text('users:x:100:foo,bar,baz\nothers:x:300:bar\n')
+    os.utime(p, ns=(0, 1))
+    assert index.lookup('foo') == {100}
+    assert index.lookup('bar') == {100, 300}
+    assert index.lookup('baz') == {100}
+    assert not index.refresh()
+
+def test_group_index_duplicate_gid(tmp_path):
+    p = tmp_path / 'group'
+    p.write_text('a:x:100:foo\nb:x:100:foo\n')
+    index = GroupIndex(str(p), check_interval=0)
+    assert index.lookup('foo') == {100}
+
+    p.write_text('a:x:100:foo\n')
+    os.utime(p, ns=(0, 1))
+    assert index.lookup('foo') == {100}
+
+def test_group_index_check_interval(tmp_path):
+    p = tmp_path / 'group'
+    p.write_text('users:x:100:foo\n')
+    index = GroupIndex(str(p), check_interval=3600)
+    p.write_text('users:x:100:bar\n')
+    os.utime(p, ns=(0, 1))
+    assert index.lookup('foo') == {100}
+    assert index.refresh()
+    assert index.lookup('foo') == set()
+
+def test_group_index_missing_file(tmp_path):
+    index = GroupIndex(str(tmp_path / 'group'), check_interval=0)
+    assert index.lookup('foo') == set()
+
+def test_group_index_bad_file(tmp_path):
+    p = tmp_path / 'group'
+    p.write_text('users:x:100:foo\n')
+    index = GroupIndex(str(p), check_interval=0)
+
+    p.write_bytes(b'users:x:100:foo,\xff\xfe\n')
+    os.utime(p, ns=(0, 1))
+    assert not index.refresh()
+    assert index.lookup('foo') == {100}
+
+    # a bad file at startup gives an empty index
+    index = GroupIndex(str(p), check_interval=0)
+    assert index.lookup('foo') == set()
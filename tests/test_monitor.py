@@ -0,0 +1,46 @@
+import asyncio
+import gc
+import logging
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from keycloak_http_auth.monitor import LoopMonitor
+
+
+def block_the_loop():
+    time.sleep(.3)
+
+@pytest.mark.asyncio
+async def test_monitor_slow_callback(caplog):
+    before = REGISTRY.get_sample_value('keycloak_http_auth_slow_callbacks_total') or 0
+    monitor = LoopMonitor(interval=.01, threshold=.1)
+    monitor.start()
+    try:
+        await asyncio.sleep(.05)
+        with caplog.at_level(logging.WARNING):
+            block_the_loop()
+            await asyncio.sleep(.05)
+    finally:
+        monitor.stop()
+
+    assert REGISTRY.get_sample_value('keycloak_http_auth_slow_callbacks_total') == before + 1
+    assert REGISTRY.get_sample_value('keycloak_http_auth_loop_lag_seconds_count') > 0
+    assert 'event loop blocked' in caplog.text
+    assert 'block_the_loop' in caplog.text
+
+@pytest.mark.asyncio
+async def test_monitor_gc_pause():
+    labels = {'generation': '2'}
+    before = REGISTRY.get_sample_value('keycloak_http_auth_gc_pause_seconds_count', labels) or 0
+    monitor = LoopMonitor()
+    monitor.start()
+    try:
+        gc.collect()
+    finally:
+        monitor.stop()
+    assert REGISTRY.get_sample_value('keycloak_http_auth_gc_pause_seconds_count', labels) == before + 1
+
+    gc.collect()
+    assert REGISTRY.get_sample_value('keycloak_http_auth_gc_pause_seconds_count', labels) == before + 1
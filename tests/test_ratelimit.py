@@ -0,0 +1,62 @@
+import pytest
+
+from keycloak_http_auth.ratelimit import TokenBucketLimiter
+
+
+def test_ratelimit_burst():
+    limiter = TokenBucketLimiter(rate=1, burst=3)
+    assert limiter.acquire('a', now=0) == 0
+    assert limiter.acquire('a', now=0) == 0
+    assert limiter.acquire('a', now=0) == 0
+    assert limiter.acquire('a', now=0) == pytest.approx(1.)
+    assert limiter.acquire('b', now=0) == 0
+
+def test_ratelimit_refill():
+    limiter = TokenBucketLimiter(rate=2, burst=1)
+    assert limiter.acquire('a', now=0) == 0
+    assert limiter.acquire('a', now=0.25) == pytest.approx(.25)
+    assert limiter.acquire('a', now=0.5) == 0
+
+def test_ratelimit_peek():
+    limiter = TokenBucketLimiter(rate=1, burst=1)
+    assert limiter.peek('a', now=0) == 0
+    assert len(limiter) == 0
+    limiter.acquire('a', now=0)
+    assert limiter.peek('a', now=0) == pytest.approx(1.)
+    assert limiter.peek('a', now=1) == 0
+
+def test_ratelimit_max_entries():
+    limiter = TokenBucketLimiter(rate=.001, burst=1, max_entries=2)
+    limiter.acquire('a', now=0)
+    limiter.acquire('b', now=0)
+    limiter.acquire('a', now=0)
+    limiter.acquire('c', now=0)
+    assert len(limiter) == 2
+    # b was least recently used
+    assert limiter.peek('b', now=0) == 0
+    assert limiter.peek('a', now=0) > 0
+
+def test_ratelimit_idle_eviction():
+    limiter = TokenBucketLimiter(rate=1, burst=2)
+    limiter.acquire('a', now=0)
+    limiter.acquire('b', now=1)
+    assert len(limiter) == 2
+    limiter.acquire('c', now=2.5)
+    assert len(limiter) == 2
+    limiter.acquire('c', now=10)
+    assert len(limiter) == 1
+
+def test_ratelimit_bad_args():
+    with pytest.raises(ValueError):
+        TokenBucketLimiter(rate=0, burst=1)
+    with pytest.raises(ValueError):
+        TokenBucketLimiter(rate=1, burst=0)
+
+def test_ratelimit_on_evict():
+    evicted = []
+    limiter = TokenBucketLimiter(rate=1, burst=1, max_entries=1, on_evict=evicted.append)
+    limiter.acquire('a', now=0)
+    limiter.acquire('b', now=0)
+    assert evicted == ['a']
+    limiter.acquire('c', now=5)
+    assert evicted == ['a', 'b']
@@ -1,13 +1,17 @@
+import os
 import socket
 import asyncio
 
 import pytest
 from requests.exceptions import HTTPError
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
 from rest_tools.client import AsyncSession
 import requests_mock
 import pytest_asyncio
 
-from keycloak_http_auth.server import create_server
+from prometheus_client import REGISTRY
+
+from keycloak_http_auth.server import create_server, ThrottledUsers
 
 from .util import *
 
@@ -98,3 +102,133 @@ async def test_server_missing_user(server):
             'X-Original-Method': 'GET',
             'X-Original-URI': '/base/',
         })
+
+@pytest.fixture
+def rate_limit(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT', '0.001')
+    monkeypatch.setenv('RATE_LIMIT_BURST', '2')
+
+@pytest.mark.asyncio
+async def test_server_rate_limit(rate_limit, server, port, make_token):
+    client, _ = server({'username': 'foo', 'uid': 1000, 'gid': 1001})
+    headers = {
+        'X-Original-Method': 'GET',
+        'X-Original-URI': '/foo',
+    }
+    await client('GET', '/', headers=headers)
+    await client('GET', '/', headers=headers)
+
+    # the rest_tools client retries on 429, so use a plain client
+    token = make_token({'username': 'foo', 'uid': 1000, 'gid': 1001}, 'issuer', 'aud')
+    with pytest.raises(HTTPClientError) as e:
+        await AsyncHTTPClient().fetch(f'http://localhost:{port}/', headers={
+            'Authorization': 'Bearer '+token,
+            **headers,
+        })
+    assert e.value.code == 429
+    assert int(e.value.response.headers['Retry-After']) > 0
+
+    metric = 'keycloak_http_auth_throttled_users_total'
+    assert REGISTRY.get_sample_value(metric, {'user': 'foo'}) > 0
+
+def test_throttled_users():
+    metric = 'keycloak_http_auth_throttled_users_total'
+    users = ThrottledUsers()
+    # two subs from different issuers with the same username
+    users.inc('sub:a', 'baz')
+    users.inc('sub:b', 'baz')
+    users.inc('sub:b', 'baz')
+    assert REGISTRY.get_sample_value(metric, {'user': 'baz'}) == 3
+
+    users('sub:a')
+    assert REGISTRY.get_sample_value(metric, {'user': 'baz'}) == 3
+    users('sub:c')
+    users('sub:b')
+    assert REGISTRY.get_sample_value(metric, {'user': 'baz'}) is None
+
+@pytest.mark.asyncio
+async def test_server_rate_limit_client_ip(rate_limit, server, port):
+    for _ in range(2):
+        with pytest.raises(HTTPClientError) as e:
+            await AsyncHTTPClient().fetch(f'http://localhost:{port}/', headers={
+                'X-Real-IP': '10.0.0.1',
+            })
+        assert e.value.code == 403
+
+    with pytest.raises(HTTPClientError) as e:
+        await AsyncHTTPClient().fetch(f'http://localhost:{port}/', headers={
+            'X-Real-IP': '10.0.0.1',
+            'Authorization': 'Bearer bad',
+        })
+    assert e.value.code == 429
+
+    # a different client is not affected
+    with pytest.raises(HTTPClientError) as e:
+        await AsyncHTTPClient().fetch(f'http://localhost:{port}/', headers={
+            'X-Real-IP': '10.0.0.2',
+        })
+    assert e.value.code == 403
+
+@pytest.fixture
+def fs_precheck(monkeypatch):
+    monkeypatch.setenv('FS_PRECHECK', 'true')
+
+@pytest.mark.asyncio
+async def test_server_fs_precheck(fs_precheck, server):
+    # a user that neither owns the test files nor is in their group
+    client, base_path = server({'username': 'foo', 'uid': os.getuid() + 1000, 'gid': os.getgid() + 1000})
+    headers = {
+        'X-Original-Method': 'GET',
+        'X-Original-URI': '/foo',
+    }
+    with open(base_path / 'foo', 'w') as f:
+        f.write('foo')
+    (base_path / 'foo').chmod(0o600)
+    with pytest.raises(HTTPError, match='403'):
+        await client('GET', '/', headers=headers)
+
+    (base_path / 'foo').chmod(0o644)
+    await asyncio.sleep(.01)  # let the inotify event be processed
+    await client('GET', '/', headers=headers)
+
+    # missing files are left to nginx
+    await client('GET', '/', headers={
+        'X-Original-Method': 'GET',
+        'X-Original-URI': '/bar',
+    })
+
+@pytest.fixture
+def group_file(monkeypatch, tmp_path):
+    p = tmp_path / 'group'
+    p.write_text('users:x:1001:foo\nadmins:x:2000:foo,bar\n')
+    monkeypatch.setenv('GROUP_FILE', str(p))
+
+@pytest.mark.asyncio
+async def test_server_group_file(group_file, server):
+    client, _ = server({'username': 'foo', 'uid': 1000, 'gid': 1001, 'group_gids': [3000]})
+    ret = await client('GET', '/', headers={
+        'X-Original-Method': 'GET',
+        'X-Original-URI': '/foo',
+    })
+    assert set(ret.headers['X_GROUPS'].split(',')) == {'1001', '2000', '3000'}
+
+@pytest.mark.asyncio
+async def test_server_fs_precheck_string_ids(fs_precheck, server):
+    headers = {
+        'X-Original-Method': 'GET',
+        'X-Original-URI': '/foo',
+    }
+    client, base_path = server({'username': 'foo', 'uid': str(os.getuid()), 'gid': str(os.getgid() + 1000)})
+    with open(base_path / 'foo', 'w') as f:
+        f.write('foo')
+    (base_path / 'foo').chmod(0o600)
+    await client('GET', '/', headers=headers)
+
+    client, _ = server({'username': 'foo', 'uid': str(os.getuid() + 1000), 'gid': str(os.getgid())})
+    (base_path / 'foo').chmod(0o640)
+    await asyncio.sleep(.01)
+    await client('GET', '/', headers=headers)
+
+    # values that are not numbers are left to nginx
+    client, _ = server({'username': 'foo', 'uid': 'abc', 'gid': 'def'})
+    await client('GET', '/', headers=headers)